@@ -1,15 +1,28 @@
 import os
 import shutil
-from typing import List
-from fastapi import FastAPI, UploadFile, File, HTTPException, Header
+import threading
+import time
+from typing import List, Optional
+
+import zstandard
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
 
 # Import the RAG logic, including the new delete function
 from rag_pipeline import (
     process_and_store_document,
-    create_rag_chain,
+    stream_answer,
     delete_document_vectors,
-    UPLOAD_DIRECTORY
+    save_query_cache,
+    warm_up_models,
+    upload_storage_path,
+    document_name_for_upload,
+    UPLOAD_DIRECTORY,
+    ZSTD_LEVEL,
+    ZSTD_SUFFIX
 )
 
 app = FastAPI(
@@ -18,6 +31,46 @@ app = FastAPI(
     version="2.1.0",
 )
 
+UPLOAD_CHUNK_SIZE = 1 << 20  # 1 MiB
+
+# Ingestion state per filename: "uploading" | "queued" | "processing" | "ready" | "error".
+# Files that were already on disk when the server started have no entry and
+# are treated as ready.
+INGESTION_STATUS = {}
+_STATUS_LOCK = threading.Lock()
+# States in which a document cannot be queried or deleted yet
+_BUSY_STATES = ("uploading", "queued", "processing")
+
+# Document name -> stored path for the files in UPLOAD_DIRECTORY, so request
+# handlers check membership in memory instead of hitting the filesystem. Uploads
+# and deletes keep it current; it is rescanned lazily once it is older than
+# FILES_TTL seconds to pick up changes made outside the API.
+FILES_TTL = 5.0
+_FILES = {}
+_FILES_SCANNED_AT = float("-inf")
+# Names reserved by uploads that are still being written. They are kept apart
+# from _FILES so a rescan cannot drop a reservation before the file exists.
+_UPLOADING = set()
+_FILES_LOCK = threading.Lock()
+
+# Response models let FastAPI serialize straight to JSON bytes through Pydantic
+# instead of running jsonable_encoder and json.dumps on a plain dict.
+class StatusMessage(BaseModel):
+    status: str
+    message: str
+
+
+class UploadAccepted(BaseModel):
+    filename: str
+    status: str
+
+
+class IngestionStatus(BaseModel):
+    filename: str
+    status: str
+    detail: Optional[str] = None
+
+
 origins = [
     "http://localhost",
     "http://localhost:3000",
@@ -33,36 +86,178 @@ app.add_middleware(
 )
 
 
-@app.get("/")
+@app.on_event("startup")
+def _warm_up_models():
+    warm_up_models()
+
+
+@app.on_event("shutdown")
+def _persist_query_cache():
+    save_query_cache()
+
+
+def _save_upload(src, file_path: str):
+    """
+    Writes an uploaded file to disk. Paths ending in .zst are stream-compressed with
+    zstd. Otherwise, uploads that Starlette has already spooled to a temporary file
+    are copied in-kernel with os.sendfile; in-memory spools and platforms without
+    file-to-file sendfile use a chunked copy.
+    """
+    with open(file_path, "wb") as dst:
+        if file_path.endswith(ZSTD_SUFFIX):
+            src.seek(0)
+            zstandard.ZstdCompressor(level=ZSTD_LEVEL).copy_stream(src, dst, write_size=UPLOAD_CHUNK_SIZE)
+            return
+        if getattr(src, "_rolled", False) and hasattr(os, "sendfile"):
+            try:
+                src_fd = src.fileno()
+                size = os.fstat(src_fd).st_size
+                offset = 0
+                while offset < size:
+                    sent = os.sendfile(dst.fileno(), src_fd, offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+                return
+            except OSError:
+                dst.seek(0)
+                dst.truncate()
+        src.seek(0)
+        shutil.copyfileobj(src, dst, UPLOAD_CHUNK_SIZE)
+
+
+def _refresh_files_locked():
+    global _FILES, _FILES_SCANNED_AT
+    if time.monotonic() - _FILES_SCANNED_AT > FILES_TTL:
+        with os.scandir(UPLOAD_DIRECTORY) as entries:
+            _FILES = {document_name_for_upload(entry.name): entry.path for entry in entries if entry.is_file()}
+        _FILES_SCANNED_AT = time.monotonic()
+
+
+def _document_path(filename: str) -> Optional[str]:
+    with _FILES_LOCK:
+        _refresh_files_locked()
+        return _FILES.get(filename)
+
+
+def _document_exists(filename: str) -> bool:
+    return _document_path(filename) is not None
+
+
+def _list_files() -> List[str]:
+    with _FILES_LOCK:
+        _refresh_files_locked()
+        return sorted(_FILES)
+
+
+def _reserve_upload(filename: str) -> bool:
+    """Atomically claims a document name for an upload. Returns False if it is taken."""
+    with _FILES_LOCK:
+        _refresh_files_locked()
+        if filename in _FILES or filename in _UPLOADING:
+            return False
+        _UPLOADING.add(filename)
+        return True
+
+
+def _finish_upload(filename: str, file_path: str = None):
+    """Releases an upload reservation, adding the stored file to the index if given."""
+    with _FILES_LOCK:
+        _UPLOADING.discard(filename)
+        if file_path is not None:
+            _FILES[filename] = file_path
+
+
+def _discard_file(filename: str):
+    with _FILES_LOCK:
+        _FILES.pop(filename, None)
+
+
+def _set_status(filename: str, status: str, detail: str = None):
+    with _STATUS_LOCK:
+        INGESTION_STATUS[filename] = {"status": status, "detail": detail}
+
+
+def _get_status(filename: str):
+    with _STATUS_LOCK:
+        return INGESTION_STATUS.get(filename)
+
+
+def ingest_document(file_path: str, filename: str, api_key: str):
+    """
+    Background task wrapper around the ingestion pipeline that records progress
+    in INGESTION_STATUS. On failure the uploaded file is removed so the user can retry.
+    """
+    _set_status(filename, "processing")
+    try:
+        process_and_store_document(file_path, filename, api_key)
+    except Exception as e:
+        print(f"Ingestion failed for {filename}: {e}")
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        _discard_file(filename)
+        _set_status(filename, "error", f"Failed to process and ingest document: {e}")
+        return
+    _set_status(filename, "ready")
+
+
+@app.get("/", response_model=StatusMessage)
 def read_root():
     return {"status": "ok", "message": "Welcome to the Multimodal RAG API!"}
 
 
-@app.post("/upload/", status_code=201)
+@app.post("/upload/", status_code=202, response_model=UploadAccepted)
 async def upload_file(
+        background_tasks: BackgroundTasks,
         gemini_api_key: str = Header(...),
         file: UploadFile = File(...)
 ):
-    file_path = os.path.join(UPLOAD_DIRECTORY, file.filename)
+    file_path = upload_storage_path(file.filename)
+    # A raw "data.csv.zst" would share the stored path of a compressed "data.csv"
+    # and be listed as "data.csv" after a rescan. Rejecting names that do not map
+    # back to themselves keeps document names and stored paths one-to-one.
+    if document_name_for_upload(os.path.basename(file_path)) != file.filename:
+        await file.close()
+        raise HTTPException(status_code=400, detail=f"'{file.filename}' clashes with the stored name of '{document_name_for_upload(file.filename)}'; rename it before uploading.")
 
-    if os.path.exists(file_path):
+    # The name is reserved before the first await, so a concurrent upload of the
+    # same name gets a 409 instead of writing the same path.
+    if not _reserve_upload(file.filename):
+        await file.close()
         raise HTTPException(status_code=409, detail="File with this name already exists.")
+    _set_status(file.filename, "uploading")
 
+    # The copy runs in the threadpool so the event loop keeps serving other
+    # requests while a large upload is being written to disk.
     try:
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        await run_in_threadpool(_save_upload, file.file, file_path)
     except Exception as e:
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        with _STATUS_LOCK:
+            INGESTION_STATUS.pop(file.filename, None)
+        _finish_upload(file.filename)
         raise HTTPException(status_code=500, detail=f"Error saving file: {e}")
     finally:
-        file.file.close()
+        await file.close()
+    _finish_upload(file.filename, file_path)
 
-    try:
-        process_and_store_document(file_path, file.filename, gemini_api_key)
-    except Exception as e:
-        os.remove(file_path)
-        raise HTTPException(status_code=500, detail=f"Failed to process and ingest document: {e}")
+    # Ingestion can take tens of seconds, so it runs after the response is sent.
+    # Progress is reported through /status/{filename}.
+    _set_status(file.filename, "queued")
+    background_tasks.add_task(ingest_document, file_path, file.filename, gemini_api_key)
 
-    return {"filename": file.filename, "status": "Successfully uploaded and processed."}
+    return {"filename": file.filename, "status": "queued"}
+
+
+@app.get("/status/{filename}", response_model=IngestionStatus)
+def get_ingestion_status(filename: str):
+    state = _get_status(filename)
+    if state is None:
+        if not _document_exists(filename):
+            raise HTTPException(status_code=404, detail="Document not found.")
+        state = {"status": "ready", "detail": None}
+    return {"filename": filename, **state}
 
 
 @app.post("/query/{filename}")
@@ -71,42 +266,60 @@ async def query_document(
         query: str,
         gemini_api_key: str = Header(...)
 ):
-    file_path = os.path.join(UPLOAD_DIRECTORY, filename)
-    if not os.path.exists(file_path):
+    if not _document_exists(filename):
         raise HTTPException(status_code=404, detail="Document not found.")
 
+    state = _get_status(filename)
+    if state and state["status"] in _BUSY_STATES:
+        raise HTTPException(status_code=409, detail="Document is still being processed.")
+
+    # Pull the first chunk before responding so retrieval and LLM errors are
+    # still reported as a proper HTTP error rather than a truncated stream.
+    answer_stream = stream_answer(filename, query, gemini_api_key)
     try:
-        rag_chain = create_rag_chain(filename, gemini_api_key)
-        answer = rag_chain.invoke(query)
-        return {"filename": filename, "query": query, "answer": answer}
+        first_chunk = await anext(answer_stream, "")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error during query processing: {e}")
 
+    async def answer_body():
+        yield first_chunk
+        async for chunk in answer_stream:
+            yield chunk
+
+    return StreamingResponse(answer_body(), media_type="text/plain; charset=utf-8")
+
 
 @app.get("/documents/", response_model=List[str])
 def list_documents():
     try:
-        return os.listdir(UPLOAD_DIRECTORY)
+        return _list_files()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Could not read directory: {e}")
 
 
-@app.delete("/documents/{filename}")
+@app.delete("/documents/{filename}", response_model=StatusMessage)
 def delete_document(filename: str):
     """
     Deletes a document AND its associated vector store data.
     """
-    file_path = os.path.join(UPLOAD_DIRECTORY, filename)
+    file_path = _document_path(filename)
 
-    if not os.path.exists(file_path):
+    if file_path is None:
         raise HTTPException(status_code=404, detail="File not found.")
 
+    state = _get_status(filename)
+    if state and state["status"] in _BUSY_STATES:
+        raise HTTPException(status_code=409, detail="Document is still being processed.")
+
     try:
         # Step 1: Delete the physical file
         os.remove(file_path)
+        _discard_file(filename)
 
         # *** Step 2: Call the new function to delete the vectors ***
         delete_document_vectors(filename)
+        with _STATUS_LOCK:
+            INGESTION_STATUS.pop(filename, None)
 
         return {"status": "ok", "message": f"File '{filename}' and its vector data deleted successfully."}
     except Exception as e:
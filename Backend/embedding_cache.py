@@ -0,0 +1,49 @@
+# embedding_cache.py
+
+import hashlib
+import sqlite3
+import threading
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    A persistent cache of embedding vectors in SQLite, keyed by a hash of the
+    text. `namespace` should identify the model that produced the vectors, so
+    switching models never serves stale embeddings. Vectors are stored as
+    `dtype` (float16 by default, half the size of float32) and returned as float32.
+    """
+
+    def __init__(self, path: str, namespace: str, dtype=np.float16):
+        self.dtype = np.dtype(dtype)
+        # The storage type is part of the key, so rows written with another dtype are never misread.
+        self.namespace = f"{namespace}:{self.dtype.name}".encode("utf-8") + b"\0"
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def key(self, text: str) -> bytes:
+        return hashlib.blake2b(self.namespace + text.encode("utf-8"), digest_size=16).digest()
+
+    def get_many(self, keys: list) -> dict:
+        """Returns {key: vector} for the keys that are cached."""
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's limit on bound parameters per statement.
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                )
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=self.dtype).astype(np.float32)
+        return found
+
+    def set_many(self, items):
+        """Stores (key, vector) pairs."""
+        rows = [(key, np.asarray(vector, dtype=self.dtype).tobytes()) for key, vector in items]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self._conn.commit()
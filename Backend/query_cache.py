@@ -0,0 +1,181 @@
+# query_cache.py
+
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class LRUCache:
+    """A thread-safe LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize: int = 2000, ttl: float = 600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, predicate):
+        """Removes every entry whose key satisfies `predicate(key)`."""
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def __getstate__(self):
+        with self._lock:
+            return {"maxsize": self.maxsize, "ttl": self.ttl, "data": OrderedDict(self._data)}
+
+    def __setstate__(self, state):
+        self.maxsize = state["maxsize"]
+        self.ttl = state["ttl"]
+        self._data = state["data"]
+        self._lock = threading.RLock()
+
+
+class SemanticCache:
+    """
+    Caches answers per document keyed by the query embedding. A lookup hits when
+    a previously answered query has cosine similarity >= `threshold`.
+    """
+
+    def __init__(self, threshold: float = 0.95, max_entries_per_document: int = 500, ttl: float = 600):
+        self.threshold = threshold
+        self.max_entries_per_document = max_entries_per_document
+        self.ttl = ttl
+        # filename -> (unit-norm embedding matrix, answers, expiry timestamps)
+        self._entries = {}
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, filename: str, embedding):
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is None:
+                return None
+            matrix, answers, expiries = entry
+            keep = np.flatnonzero(expiries >= time.time())
+            if len(keep) < len(answers):
+                matrix, answers, expiries = matrix[keep], [answers[i] for i in keep], expiries[keep]
+                self._entries[filename] = (matrix, answers, expiries)
+            if not answers:
+                return None
+            similarities = matrix @ self._normalize(embedding)
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.threshold:
+                return answers[best]
+            return None
+
+    def add(self, filename: str, embedding, answer: str):
+        vector = self._normalize(embedding)[np.newaxis, :]
+        expiry = np.array([time.time() + self.ttl])
+        with self._lock:
+            entry = self._entries.get(filename)
+            if entry is None:
+                matrix, answers, expiries = vector, [answer], expiry
+            else:
+                matrix = np.vstack([entry[0], vector])
+                answers = entry[1] + [answer]
+                expiries = np.concatenate([entry[2], expiry])
+            # Keep only the most recent entries for this document.
+            limit = self.max_entries_per_document
+            self._entries[filename] = (matrix[-limit:], answers[-limit:], expiries[-limit:])
+
+    def invalidate(self, filename: str):
+        with self._lock:
+            self._entries.pop(filename, None)
+
+    def __getstate__(self):
+        with self._lock:
+            return {
+                "threshold": self.threshold,
+                "max_entries_per_document": self.max_entries_per_document,
+                "ttl": self.ttl,
+                "entries": dict(self._entries),
+            }
+
+    def __setstate__(self, state):
+        self.threshold = state["threshold"]
+        self.max_entries_per_document = state["max_entries_per_document"]
+        self.ttl = state["ttl"]
+        self._entries = state["entries"]
+        self._lock = threading.RLock()
+
+
+class QueryCache:
+    """
+    Two-level answer cache for the RAG chain: an exact-match LRU keyed by
+    (filename, query), backed by a semantic cache over query embeddings.
+    """
+
+    def __init__(self, maxsize: int = 2000, ttl: float = 600, similarity_threshold: float = 0.95):
+        self.exact = LRUCache(maxsize=maxsize, ttl=ttl)
+        self.semantic = SemanticCache(threshold=similarity_threshold, ttl=ttl)
+
+    def get_exact(self, filename: str, query: str):
+        return self.exact.get((filename, query))
+
+    def get_similar(self, filename: str, embedding):
+        return self.semantic.lookup(filename, embedding)
+
+    def add(self, filename: str, query: str, embedding, answer: str):
+        self.exact.set((filename, query), answer)
+        self.semantic.add(filename, embedding, answer)
+
+    def invalidate(self, filename: str):
+        """Drops every cached answer for a document."""
+        self.exact.invalidate(lambda key: key[0] == filename)
+        self.semantic.invalidate(filename)
+
+    def save(self, path: str):
+        """Writes the cache to disk so a restarted server starts warm."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump({"exact": self.exact, "semantic": self.semantic}, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str):
+        """Restores a cache written by `save`. A missing or unreadable file is ignored."""
+        if not os.path.exists(path):
+            return
+        try:
+            with open(path, "rb") as f:
+                state = pickle.load(f)
+            self.exact = state["exact"]
+            self.semantic = state["semantic"]
+        except Exception as e:
+            print(f"Could not load query cache from {path}: {e}")
@@ -1,23 +1,46 @@
 # rag_pipeline.py (Updated)
 
+import asyncio
+import atexit
+import base64
+import chromadb
+import hashlib
 import os
-from PIL import Image
+import pickle
+import queue
+import re
+import tempfile
+import threading
+import uuid
+import lxml.html
+import numpy as np
+import onnxruntime as ort
+import torch
+import zstandard
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 from io import BytesIO
+from chromadb.config import Settings
 
 # LangChain and AI Model Imports
 from langchain_google_genai import ChatGoogleGenerativeAI, HarmBlockThreshold, HarmCategory
 from langchain.embeddings import HuggingFaceEmbeddings
 from langchain.vectorstores.chroma import Chroma
-from langchain.prompts import PromptTemplate
+from langchain.prompts import ChatPromptTemplate
 from langchain.schema.document import Document
 from langchain.schema.output_parser import StrOutputParser
-from langchain.schema.runnable import RunnablePassthrough, RunnableLambda, RunnableParallel
+from langchain.schema.runnable import RunnableLambda
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 
 # Document Processing Imports
 from unstructured.partition.auto import partition
 from unstructured.documents.elements import Table, Image as UnstructuredImage
 from sentence_transformers import CrossEncoder
+from transformers import AutoTokenizer
+
+from embedding_cache import EmbeddingCache
+from query_cache import LRUCache, QueryCache
 
 # ==============================================================================
 # Global Variables and Model Initialization
@@ -25,30 +48,296 @@ from sentence_transformers import CrossEncoder
 VECTORSTORE_DIRECTORY = "./vector_store"
 UPLOAD_DIRECTORY = "./uploaded_files"
 
+# Text-like uploads are stored zstd-compressed. PDFs, images and Office files are
+# already compressed containers, so they are stored as-is.
+COMPRESSED_UPLOAD_EXTENSIONS = {".csv", ".tsv", ".txt", ".md", ".html", ".htm", ".json", ".xml", ".eml"}
+ZSTD_SUFFIX = ".zst"
+ZSTD_LEVEL = 3
+# Partition results keyed by the SHA-256 of the stored file, so re-uploads and
+# retried ingestions skip the layout model. The directory is not listed as a document.
+PARSED_CACHE_DIRECTORY = os.path.join(UPLOAD_DIRECTORY, ".parsed")
+
+# Maximum number of concurrent Gemini calls while summarizing tables and images
+LLM_CONCURRENCY = 8
+# Tables up to this size are rendered to Markdown locally instead of being
+# summarized by Gemini; the full table fits comfortably in one chunk.
+MAX_LOCAL_TABLE_ROWS = 20
+MAX_LOCAL_TABLE_COLUMNS = 8
+# Gemini clients talk gRPC, i.e. HTTP/2: concurrent calls made through one shared
+# client are multiplexed over a single TLS connection.
+GEMINI_TRANSPORT = "grpc"
+# Answers are generated from a few reranked chunks and table summaries from one
+# table, which a Flash-tier model handles at much lower latency than Pro.
+GEMINI_TEXT_MODEL = "gemini-2.5-flash"
+EMBEDDING_MODEL_NAME = "sentence-transformers/all-mpnet-base-v2"
+# Number of texts encoded per forward pass of the embedding model
+EMBEDDING_BATCH_SIZE = 64
+# Text chunks are measured in embedding-model tokens so they fit mpnet's
+# 384-token window (including [CLS]/[SEP]) instead of being silently truncated.
+CHUNK_SIZE_TOKENS = 380
+CHUNK_OVERLAP_TOKENS = 40
+# Two-stage funnel: the vector store's bi-encoder ranking is the shallow stage
+# and only its best RETRIEVER_K hits go through the cross-encoder, which keeps
+# the top RERANK_TOP_N. Chroma already returns hits ordered by distance, so
+# fetching more and truncating would be the same as fetching RETRIEVER_K.
+RETRIEVER_K = 12
+RERANK_TOP_N = 5
+# Hits farther than this cosine distance from the question are dropped before
+# reranking. When fewer than RERANK_MIN_CANDIDATES remain they are used in vector
+# order without running the cross-encoder; when none remain, every hit is reranked.
+RETRIEVAL_MAX_DISTANCE = 0.6
+RERANK_MIN_CANDIDATES = 3
+# Chroma reports squared L2 for "l2" collections (the default of ones created before
+# cosine was configured); for normalized embeddings that is twice the cosine distance.
+# "ip" distances (1 - dot product) already equal cosine distances.
+_DISTANCE_SCALE = {"cosine": 1.0, "ip": 1.0, "l2": 2.0}
+# Upper bound on the context sent to Gemini, which keeps prompt size and cost
+# predictable whatever the chunk lengths.
+CONTEXT_MAX_CHARS = 8000
+# Number of (query, candidate) pairs scored per cross-encoder forward pass
+RERANK_BATCH_SIZE = 32
+# Upper bounds (in characters of query + candidate, about 32/64/128/256 tokens)
+# of the length buckets scored in separate forward passes, so short table
+# summaries are not padded to the longest text chunk.
+RERANK_LENGTH_BUCKETS = (128, 256, 512, 1024)
+# Pairs built from stored token IDs have exact lengths: they are sorted by length
+# and scored in mini-batches of this size, each padded to its own longest pair.
+RERANK_MINI_BATCH_SIZE = 8
+RERANKER_MODEL_NAME = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+# Chunks are stored with their reranker token IDs (up to RERANK_MAX_DOC_TOKENS),
+# so at query time only the question is tokenized. A pair fills at most
+# RERANK_MAX_LENGTH tokens, including [CLS] and two [SEP].
+RERANK_TOKENS_METADATA_KEY = "rerank_input_ids"
+RERANK_MAX_LENGTH = 512
+RERANK_MAX_DOC_TOKENS = 480
+RERANK_MAX_QUERY_TOKENS = 64
+
+# HNSW index settings applied when a document's collection is created. Embeddings
+# are unit-normalized at encode time; hnswlib's cosine space is an inner product
+# over normalized vectors, so a query costs the same as "ip" while staying exact
+# for any input. Chroma always searches through this ANN index.
+HNSW_COLLECTION_METADATA = {
+    "hnsw:space": "cosine",
+    "hnsw:M": 24,
+    "hnsw:construction_ef": 128,
+    # Wider than RETRIEVER_K needs, so the smaller candidate set keeps its recall
+    "hnsw:search_ef": 120,
+}
+# Documents with more chunks than this get a denser graph and a wider search beam
+LARGE_COLLECTION_THRESHOLD = 100_000
+LARGE_COLLECTION_HNSW_METADATA = {"hnsw:M": 32, "hnsw:search_ef": 200}
+
+# On CPU the embedding model runs on ONNX Runtime using the int8 dynamically
+# quantized export published with the model; set EMBEDDING_BACKEND=torch for the
+# FP32 PyTorch model. With a CUDA GPU it runs in FP16 on the GPU instead.
+MODEL_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "onnx")
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+# Same for the cross-encoder reranker; RERANKER_BACKEND=torch selects PyTorch.
+# On a CUDA GPU it also runs in FP16 on the GPU.
+RERANKER_BACKEND = os.getenv("RERANKER_BACKEND", "onnx")
+RERANKER_ONNX_FILE = os.getenv("RERANKER_ONNX_FILE", "onnx/model_qint8_avx512_vnni.onnx")
+# With the PyTorch backend the reranker is compiled with torch.compile; the
+# first (warm-up) call pays the compile cost. RERANKER_COMPILE=0 keeps it eager.
+RERANKER_COMPILE = os.getenv("RERANKER_COMPILE", "1") == "1"
+# Independent ONNX reranker sessions, so concurrent queries do not queue behind
+# one another. The cores are split between them instead of oversubscribed.
+RERANKER_POOL_SIZE = max(1, int(os.getenv("RERANKER_POOL_SIZE", "2")))
+RERANKER_THREADS = int(os.getenv("RERANKER_THREADS", max(1, (os.cpu_count() or 2) // RERANKER_POOL_SIZE)))
+
+# Worker processes for embedding large ingestions on CPU with the PyTorch backend
+# (0 disables the pool). The ONNX Runtime session already uses every core
+# through intra-op threads, so the pool would only oversubscribe them there.
+EMBEDDING_POOL_PROCESSES = int(os.getenv("EMBEDDING_POOL_PROCESSES", "0"))
+# Smaller batches are embedded in-process; shipping them to the pool costs more
+# than it saves.
+EMBEDDING_POOL_MIN_TEXTS = 128
+
 os.makedirs(VECTORSTORE_DIRECTORY, exist_ok=True)
 os.makedirs(UPLOAD_DIRECTORY, exist_ok=True)
+os.makedirs(PARSED_CACHE_DIRECTORY, exist_ok=True)
+
+# One Chroma client for every collection, so the persistent store is opened once
+# per process rather than by each Chroma wrapper.
+_CHROMA_CLIENT = chromadb.PersistentClient(
+    path=VECTORSTORE_DIRECTORY, settings=Settings(anonymized_telemetry=False)
+)
+
+
+def _embedding_model_kwargs() -> dict:
+    """SentenceTransformer loading options for the embedding model on this machine."""
+    if MODEL_DEVICE == "cuda":
+        return {"device": "cuda", "model_kwargs": {"torch_dtype": torch.float16}}
+    if EMBEDDING_BACKEND == "onnx":
+        return {"backend": "onnx", "model_kwargs": {"file_name": EMBEDDING_ONNX_FILE}}
+    return {"device": "cpu"}
+
+
+def _cross_encoder_kwargs() -> dict:
+    """CrossEncoder loading options for the reranker on this machine."""
+    if MODEL_DEVICE == "cuda":
+        return {"device": "cuda", "model_kwargs": {"torch_dtype": torch.float16}}
+    if RERANKER_BACKEND == "onnx":
+        session_options = ort.SessionOptions()
+        session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session_options.intra_op_num_threads = RERANKER_THREADS
+        return {
+            "backend": "onnx",
+            "model_kwargs": {
+                "file_name": RERANKER_ONNX_FILE,
+                "provider": "CPUExecutionProvider",
+                "session_options": session_options,
+            },
+        }
+    return {"device": "cpu"}
+
 
 print("Initializing models...")
-EMBEDDING_MODEL = HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
-CROSS_ENCODER_MODEL = CrossEncoder('cross-encoder/ms-marco-MiniLM-L-6-v2')
+EMBEDDING_MODEL = HuggingFaceEmbeddings(
+    model_name=EMBEDDING_MODEL_NAME,
+    model_kwargs=_embedding_model_kwargs(),
+    encode_kwargs={"batch_size": EMBEDDING_BATCH_SIZE, "normalize_embeddings": True},
+)
+CROSS_ENCODER_MODEL = CrossEncoder(RERANKER_MODEL_NAME, **_cross_encoder_kwargs())
+# Kept so a failed compilation can fall back to eager mode
+_EAGER_CROSS_ENCODER_MODULE = CROSS_ENCODER_MODEL.model
+if RERANKER_COMPILE and (MODEL_DEVICE == "cuda" or RERANKER_BACKEND != "onnx") and hasattr(torch, "compile"):
+    # Pair lengths differ between queries, so compile for dynamic shapes.
+    CROSS_ENCODER_MODEL.model = torch.compile(_EAGER_CROSS_ENCODER_MODULE, mode="reduce-overhead", dynamic=True)
+# Each pool slot gets its own ONNX Runtime session on CPU. The PyTorch model (and
+# a GPU) is shared by every slot, since it already runs concurrent calls.
+_RERANKERS = [CROSS_ENCODER_MODEL] + [
+    CrossEncoder(RERANKER_MODEL_NAME, **_cross_encoder_kwargs())
+    for _ in range(RERANKER_POOL_SIZE - 1 if MODEL_DEVICE == "cpu" and RERANKER_BACKEND == "onnx" else 0)
+]
+_RERANKER_POOL = queue.Queue()
+for _slot in range(RERANKER_POOL_SIZE):
+    _RERANKER_POOL.put(_RERANKERS[_slot % len(_RERANKERS)])
+# Always called with the same settings (no special tokens, truncation or
+# padding), so concurrent ingestions and queries never reconfigure it.
+RERANK_TOKENIZER = AutoTokenizer.from_pretrained(RERANKER_MODEL_NAME)
+# The splitter gets its own tokenizer instance: a fast tokenizer shared with the
+# embedder across threads can fail with "Already borrowed" while either one
+# reconfigures truncation.
+TEXT_SPLITTER = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+    AutoTokenizer.from_pretrained(EMBEDDING_MODEL_NAME),
+    chunk_size=CHUNK_SIZE_TOKENS,
+    chunk_overlap=CHUNK_OVERLAP_TOKENS,
+)
 print("Models initialized successfully.")
 
+# Answers are cached per document, both by exact query text and by query
+# embedding similarity, and persisted across restarts.
+QUERY_CACHE_PATH = os.path.join(VECTORSTORE_DIRECTORY, "query_cache.pkl")
+QUERY_CACHE = QueryCache(maxsize=2000, ttl=600, similarity_threshold=0.95)
+QUERY_CACHE.load(QUERY_CACHE_PATH)
+
+# Chunk embeddings keyed by content hash, so re-ingesting a document (or one that
+# shares text with an earlier upload) only runs the model on new chunks.
+EMBEDDING_CACHE = EmbeddingCache(
+    os.path.join(VECTORSTORE_DIRECTORY, "embedding_cache.sqlite3"),
+    namespace=f"{EMBEDDING_MODEL_NAME}:{MODEL_DEVICE}:{EMBEDDING_BACKEND}:{EMBEDDING_ONNX_FILE}",
+)
+
+# Cross-encoder scores keyed by (sha1(query), sha1(chunk text)). A score only
+# depends on the two texts, so entries never go stale; they just age out.
+RERANK_SCORE_CACHE = LRUCache(maxsize=100_000, ttl=24 * 3600)
+
+# Retrieved chunks keyed by (filename, hash of the query embedding rounded to 3
+# decimals), so repeated questions skip the HNSW search.
+RETRIEVAL_CACHE = LRUCache(maxsize=512, ttl=600)
+
+# Multi-process embedding pool, started by warm_up_models when enabled
+_EMBEDDING_POOL = None
+
+# Built RAG chains keyed by (filename, api_key), so the vector store handle,
+# retriever and prompt composition are set up once per document. Chains never go
+# stale on their own, so only the LRU bound evicts them (old API keys age out);
+# the lock makes sure each chain is built once.
+_CHAINS = LRUCache(maxsize=32, ttl=float("inf"))
+_CHAINS_LOCK = threading.Lock()
+
+# Open Chroma handles keyed by collection name, so the SQLite database and HNSW
+# segment are loaded once rather than on every ingest, query and delete.
+_VECTOR_STORES = {}
+_VECTOR_STORES_LOCK = threading.Lock()
+
 
 # ==============================================================================
 # Helper Functions
 # ==============================================================================
 
+def upload_storage_path(filename: str) -> str:
+    """Returns where an uploaded document is stored, with a .zst suffix when it is compressed."""
+    path = os.path.join(UPLOAD_DIRECTORY, filename)
+    if os.path.splitext(filename)[1].lower() in COMPRESSED_UPLOAD_EXTENSIONS:
+        path += ZSTD_SUFFIX
+    return path
+
+
+def document_name_for_upload(stored_name: str) -> str:
+    """Maps a file name in UPLOAD_DIRECTORY back to the name of the uploaded document."""
+    if stored_name.endswith(ZSTD_SUFFIX):
+        original = stored_name[:-len(ZSTD_SUFFIX)]
+        if os.path.splitext(original)[1].lower() in COMPRESSED_UPLOAD_EXTENSIONS:
+            return original
+    return stored_name
+
+
+_UNSAFE_COLLECTION_CHARS = re.compile(r"[^A-Za-z0-9_-]")
+# A name that already ends like a hash suffix is hashed too, so it cannot equal
+# the hashed name of another file.
+_DIGEST_SUFFIX = re.compile(r"_[0-9a-f]{8}$")
+MAX_COLLECTION_NAME_LENGTH = 63
+
+
+@lru_cache(maxsize=1024)
 def sanitize_filename_for_collection(filename: str) -> str:
-    """Sanitizes a filename to be a valid ChromaDB collection name."""
-    safe_name = filename.replace(" ", "_").replace(".", "_")
-    return f"rag_{safe_name}"
+    """
+    Sanitizes a filename to be a valid ChromaDB collection name: at most 63
+    characters from [A-Za-z0-9_-], ending in an alphanumeric character. Names
+    that are too long, end badly or had any character replaced get a short
+    hash suffix, so distinct filenames never share a collection.
+    """
+    name = f"rag_{_UNSAFE_COLLECTION_CHARS.sub('_', filename)}"
+    if (len(name) > MAX_COLLECTION_NAME_LENGTH or not name[-1].isalnum()
+            or _UNSAFE_COLLECTION_CHARS.search(filename) or _DIGEST_SUFFIX.search(name)):
+        digest = hashlib.sha1(filename.encode("utf-8")).hexdigest()[:8]
+        name = f"{name[:MAX_COLLECTION_NAME_LENGTH - len(digest) - 1]}_{digest}"
+    return name
 
 
-def get_image_description(image_bytes: bytes, api_key: str) -> str:
-    """Generates a description for an image using Gemini Vision."""
-    vision_llm = ChatGoogleGenerativeAI(
+def _legacy_collection_name(filename: str) -> str:
+    """The collection name used before names were hashed, e.g. rag_report_pdf for "report.pdf"."""
+    return f"rag_{filename.replace(' ', '_').replace('.', '_')}"
+
+
+def _document_collection_name(filename: str) -> str:
+    """
+    Returns the collection for a document. A document ingested under its legacy
+    name keeps that collection as long as it holds the document's chunks; legacy
+    names collide, so merely existing is not enough.
+    """
+    name = sanitize_filename_for_collection(filename)
+    legacy_name = _legacy_collection_name(filename)
+    if legacy_name != name:
+        try:
+            legacy = _CHROMA_CLIENT.get_collection(legacy_name)
+        except Exception:
+            # Missing, or not a valid collection name
+            return name
+        if legacy.get(where={"source": filename}, limit=1, include=[])["ids"]:
+            return legacy_name
+    return name
+
+
+@lru_cache(maxsize=8)
+def _vision_llm(api_key: str) -> ChatGoogleGenerativeAI:
+    """Returns a shared Gemini Vision client per API key, reusing its connection."""
+    return ChatGoogleGenerativeAI(
         model="gemini-pro-vision",
         google_api_key=api_key,
+        transport=GEMINI_TRANSPORT,
         safety_settings={
             HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
             HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
@@ -56,7 +345,89 @@ def get_image_description(image_bytes: bytes, api_key: str) -> str:
             HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
         },
     )
-    image = Image.open(BytesIO(image_bytes))
+
+
+@lru_cache(maxsize=8)
+def _text_llm(api_key: str) -> ChatGoogleGenerativeAI:
+    """Returns a shared Gemini text client per API key, reusing its connection."""
+    return ChatGoogleGenerativeAI(model=GEMINI_TEXT_MODEL, google_api_key=api_key, transport=GEMINI_TRANSPORT)
+
+
+def configure_hnsw_params(vector_count: int) -> dict:
+    """Returns the HNSW collection metadata for a document with `vector_count` chunks."""
+    if vector_count > LARGE_COLLECTION_THRESHOLD:
+        return {**HNSW_COLLECTION_METADATA, **LARGE_COLLECTION_HNSW_METADATA}
+    return dict(HNSW_COLLECTION_METADATA)
+
+
+def _open_vector_store(collection_name: str, collection_metadata: dict = None) -> Chroma:
+    """
+    Opens the persistent Chroma collection for a document, creating it if needed.
+    `collection_metadata` only takes effect when the collection is created.
+    """
+    return Chroma(
+        client=_CHROMA_CLIENT,
+        collection_name=collection_name,
+        embedding_function=EMBEDDING_MODEL,
+        collection_metadata=collection_metadata,
+    )
+
+
+def _get_vector_store(collection_name: str, collection_metadata: dict = None) -> Chroma:
+    """Returns the cached Chroma handle for a collection, opening it on first use."""
+    with _VECTOR_STORES_LOCK:
+        vector_store = _VECTOR_STORES.get(collection_name)
+        if vector_store is None:
+            vector_store = _open_vector_store(collection_name, collection_metadata)
+            _VECTOR_STORES[collection_name] = vector_store
+    return vector_store
+
+
+def _holds_other_documents(vector_store: Chroma, filename: str) -> bool:
+    """True if the collection has text or table chunks from a document other than `filename`."""
+    others = vector_store._collection.get(
+        where={"$and": [{"source": {"$ne": filename}}, {"type": {"$ne": "image_description"}}]},
+        limit=1,
+        include=[],
+    )
+    return bool(others["ids"])
+
+
+def _recreate_vector_store(collection_name: str, collection_metadata: dict) -> Chroma:
+    """Drops a collection and creates it again, replacing the cached handle."""
+    with _VECTOR_STORES_LOCK:
+        _VECTOR_STORES.pop(collection_name, None)
+        _open_vector_store(collection_name)  # get-or-create, so the delete cannot miss
+        _CHROMA_CLIENT.delete_collection(collection_name)
+        vector_store = _open_vector_store(collection_name, collection_metadata)
+        _VECTOR_STORES[collection_name] = vector_store
+    return vector_store
+
+
+_IMAGE_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+
+
+def _image_mime_type(image_bytes: bytes) -> str:
+    """Detects an image's MIME type from its first few header bytes."""
+    for signature, mime_type in _IMAGE_SIGNATURES:
+        if image_bytes.startswith(signature):
+            return mime_type
+    if image_bytes[:4] == b"RIFF" and image_bytes[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/jpeg"
+
+
+def get_image_description(image_bytes: bytes, api_key: str) -> str:
+    """Generates a description for an image using Gemini Vision."""
+    vision_llm = _vision_llm(api_key)
+    # Send the encoded bytes as-is rather than decoding them into a PIL image
+    # only for LangChain to re-encode it.
+    image = f"data:{_image_mime_type(image_bytes)};base64,{base64.b64encode(image_bytes).decode('ascii')}"
     prompt_text = "You are an expert at analyzing documents. Provide a detailed, comprehensive description of this image, which was extracted from a document. Describe all objects, charts, graphs, and any text visible. This description will be used for a retrieval system, so be as descriptive as possible."
     message = {"role": "user",
                "content": [{"type": "text", "text": prompt_text}, {"type": "image_url", "image_url": image}]}
@@ -64,18 +435,161 @@ def get_image_description(image_bytes: bytes, api_key: str) -> str:
     return response.content
 
 
+def _small_table_markdown(table_html: str):
+    """
+    Renders an HTML table as Markdown if it has at most MAX_LOCAL_TABLE_ROWS data
+    rows and MAX_LOCAL_TABLE_COLUMNS columns. Returns None otherwise.
+    """
+    try:
+        table = lxml.html.fromstring(table_html)
+    except (ValueError, lxml.etree.ParserError):
+        return None
+    rows = [
+        [" ".join(cell.text_content().split()).replace("|", "\\|") for cell in row.xpath("./th|./td")]
+        for row in table.iter("tr")
+    ]
+    rows = [row for row in rows if row]
+    if not rows or len(rows) - 1 > MAX_LOCAL_TABLE_ROWS:
+        return None
+    width = max(len(row) for row in rows)
+    if width > MAX_LOCAL_TABLE_COLUMNS:
+        return None
+
+    rows = [row + [""] * (width - len(row)) for row in rows]
+    lines = ["| " + " | ".join(rows[0]) + " |", "|" + " --- |" * width]
+    lines += ["| " + " | ".join(row) + " |" for row in rows[1:]]
+    return "\n".join(lines)
+
+
 def summarize_table(table_element: Table, api_key: str) -> str:
-    """Summarizes a table element using Gemini."""
+    """
+    Summarizes a table element. Small tables are rendered to Markdown locally;
+    larger ones are summarized by Gemini.
+    """
     table_html = table_element.metadata.text_as_html
+    if table_html:
+        markdown = _small_table_markdown(table_html)
+        if markdown is not None:
+            return markdown
     prompt = f"You are an expert at analyzing tables. Summarize the following HTML table. Describe its structure, columns, and a few example rows to capture its essence. This summary will be used for a retrieval system.\n\nTable:\n{table_html}"
-    model = ChatGoogleGenerativeAI(model="gemini-1.5-flash", google_api_key=api_key)
-    response = model.invoke(prompt)
+    response = _text_llm(api_key).invoke(prompt)
     return response.content
 
+
+def _table_document(table_element: Table, filename: str, api_key: str) -> Document:
+    summary = summarize_table(table_element, api_key)
+    return Document(page_content=summary, metadata={"source": filename, "type": "table_summary"})
+
+
+def _image_document(image_path: str, filename: str, api_key: str):
+    """Describes an extracted image. Returns None if the image could not be processed."""
+    try:
+        with open(image_path, "rb") as img_file:
+            img_bytes = img_file.read()
+        description = get_image_description(img_bytes, api_key)
+        return Document(page_content=description,
+                        metadata={"source": filename, "type": "image_description", "image_path": image_path})
+    except Exception as e:
+        print(f"Could not process image {image_path}: {e}")
+        return None
+
+def _file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _images_present(elements: list, sha: str) -> bool:
+    """Whether every extracted image the elements reference still exists in an image directory for `sha`."""
+    cache_root = os.path.abspath(PARSED_CACHE_DIRECTORY)
+    for element in elements:
+        path = getattr(element.metadata, "image_path", None)
+        if isinstance(element, UnstructuredImage) and path:
+            image_dir = os.path.dirname(os.path.abspath(path))
+            if (os.path.dirname(image_dir) != cache_root or not os.path.basename(image_dir).startswith(f"{sha}-")
+                    or not os.path.exists(path)):
+                return False
+    return True
+
+
+def _partition_document(file_path: str, filename: str) -> list:
+    """
+    Partitions a stored upload with Unstructured, reusing the elements from an
+    earlier run on identical bytes when they are in PARSED_CACHE_DIRECTORY.
+    PDF images are extracted into a fresh directory named after the same hash:
+    Unstructured gives every document's images the same figure-<page>-<n> names,
+    and ingestions run concurrently.
+    """
+    sha = _file_sha256(file_path)
+    cache_path = os.path.join(PARSED_CACHE_DIRECTORY, f"{sha}.pkl")
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                elements = pickle.load(f)
+            if _images_present(elements, sha):
+                print(f"Reusing parsed elements for {filename} from {cache_path}")
+                return elements
+            print(f"Extracted images for {filename} are missing, parsing it again")
+        except Exception as e:
+            print(f"Could not load parsed elements from {cache_path}: {e}")
+
+    if file_path.endswith(ZSTD_SUFFIX):
+        with open(file_path, "rb") as f:
+            data = zstandard.ZstdDecompressor().stream_reader(f).read()
+        elements = partition(file=BytesIO(data), metadata_filename=filename, infer_table_structure=True)
+    else:
+        image_dir = tempfile.mkdtemp(prefix=f"{sha}-", dir=PARSED_CACHE_DIRECTORY)
+        try:
+            elements = partition(filename=file_path, extract_images_in_pdf=True, infer_table_structure=True,
+                                 image_output_dir_path=image_dir)
+        finally:
+            if not os.listdir(image_dir):
+                os.rmdir(image_dir)
+
+    tmp_path = f"{cache_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump(elements, f)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        print(f"Could not cache parsed elements for {filename}: {e}")
+    return elements
+
 # ==============================================================================
 # Core RAG Ingestion and Querying Logic
 # ==============================================================================
 
+def _encode_token_ids(ids) -> str:
+    """Packs token IDs into a base64 string, since Chroma metadata values must be scalars."""
+    return base64.b64encode(np.asarray(ids, dtype=np.uint16).tobytes()).decode("ascii")
+
+
+def _decode_token_ids(encoded: str) -> list:
+    return np.frombuffer(base64.b64decode(encoded), dtype=np.uint16).tolist()
+
+
+def _embed_texts(texts: list) -> list:
+    """Embeds texts, reusing vectors from EMBEDDING_CACHE and encoding only the misses."""
+    keys = [EMBEDDING_CACHE.key(text) for text in texts]
+    cached = EMBEDDING_CACHE.get_many(list(set(keys)))
+    missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+    if missing:
+        if _EMBEDDING_POOL is not None and len(missing) > EMBEDDING_POOL_MIN_TEXTS:
+            vectors = EMBEDDING_MODEL.client.encode_multi_process(
+                list(missing.values()), _EMBEDDING_POOL,
+                batch_size=EMBEDDING_BATCH_SIZE, normalize_embeddings=True,
+            )
+        else:
+            vectors = EMBEDDING_MODEL.embed_documents(list(missing.values()))
+        new = dict(zip(missing, vectors))
+        EMBEDDING_CACHE.set_many(new.items())
+        cached.update(new)
+    print(f"Embedded {len(missing)} new chunks ({len(texts) - len(missing)} from cache)")
+    return [np.asarray(cached[key], dtype=np.float32).tolist() for key in keys]
+
+
 def process_and_store_document(file_path: str, filename: str, api_key: str):
     """
     The main ingestion pipeline. Parses a document, processes its elements,
@@ -84,139 +598,429 @@ def process_and_store_document(file_path: str, filename: str, api_key: str):
     print(f"Starting ingestion for {filename}...")
 
     # Use Unstructured.io to partition the document
-    elements = partition(filename=file_path, extract_images_in_pdf=True, infer_table_structure=True,
-                         image_output_dir_path=UPLOAD_DIRECTORY)
+    elements = _partition_document(file_path, filename)
 
     documents_to_embed = []
-    raw_text = ""
+    text_parts = []
 
-    for element in elements:
-        if isinstance(element, Table):
-            summary = summarize_table(element, api_key)
-            documents_to_embed.append(
-                Document(page_content=summary, metadata={"source": filename, "type": "table_summary"}))
-        elif isinstance(element, UnstructuredImage):
-            try:
-                with open(element.metadata.image_path, "rb") as img_file:
-                    img_bytes = img_file.read()
-                description = get_image_description(img_bytes, api_key)
-                documents_to_embed.append(Document(page_content=description,
-                                                   metadata={"source": element.metadata.image_path,
-                                                             "type": "image_description"}))
-            except Exception as e:
-                print(f"Could not process image {element.metadata.image_path}: {e}")
-        else:
-            raw_text += element.text + "\n\n"
+    # Table summaries and image descriptions are independent Gemini round trips,
+    # so they are issued concurrently and collected in document order. The text
+    # is split while those requests are in flight.
+    with ThreadPoolExecutor(max_workers=LLM_CONCURRENCY) as executor:
+        pending = []
+        for element in elements:
+            if isinstance(element, Table):
+                pending.append(executor.submit(_table_document, element, filename, api_key))
+            elif isinstance(element, UnstructuredImage):
+                pending.append(executor.submit(_image_document, element.metadata.image_path, filename, api_key))
+            else:
+                text_parts.append(element.text)
+
+        # Intelligently chunk the collected raw text
+        text_chunks = TEXT_SPLITTER.split_text("\n\n".join(text_parts))
+
+        for future in pending:
+            document = future.result()
+            if document is not None:
+                documents_to_embed.append(document)
 
-    # Intelligently chunk the collected raw text
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=750, chunk_overlap=100)
-    text_chunks = text_splitter.split_text(raw_text)
     for chunk in text_chunks:
         documents_to_embed.append(Document(page_content=chunk, metadata={"source": filename, "type": "text"}))
 
-    collection_name = sanitize_filename_for_collection(filename)
+    collection_name = _document_collection_name(filename)
 
-    vector_store = Chroma(
-        collection_name=collection_name,
-        embedding_function=EMBEDDING_MODEL,
-        persist_directory=VECTORSTORE_DIRECTORY
-    )
-    vector_store.add_documents(documents_to_embed)
-    vector_store.persist()
+    hnsw_metadata = configure_hnsw_params(len(documents_to_embed))
+    vector_store = _get_vector_store(collection_name, hnsw_metadata)
+    # Clear chunks left over from an earlier ingestion of this document only; the
+    # collection may also hold other documents.
+    vector_store._collection.delete(where={"source": filename})
+    # HNSW settings are fixed at creation, so a collection created with older
+    # settings is rebuilt, unless that would drop another document's chunks.
+    if vector_store._collection.metadata != hnsw_metadata:
+        if _holds_other_documents(vector_store, filename):
+            print(f"Keeping HNSW settings of {collection_name}: it holds other documents")
+        else:
+            print(f"Recreating collection {collection_name} with HNSW settings {hnsw_metadata}")
+            vector_store = _recreate_vector_store(collection_name, hnsw_metadata)
+    if documents_to_embed:
+        # Embed every uncached chunk in a single batched call and hand the vectors
+        # to Chroma directly, so the model runs full batches over the whole
+        # document. sentence-transformers sorts the texts by length internally, so
+        # each mini-batch is padded only to its own longest text.
+        texts = [doc.page_content for doc in documents_to_embed]
+        embeddings = _embed_texts(texts)
+        metadatas = [doc.metadata for doc in documents_to_embed]
+        token_ids = RERANK_TOKENIZER(texts, add_special_tokens=False)["input_ids"]
+        for metadata, ids in zip(metadatas, token_ids):
+            metadata[RERANK_TOKENS_METADATA_KEY] = _encode_token_ids(ids[:RERANK_MAX_DOC_TOKENS])
+        # Chroma rejects add() calls above the batch limit of its backend.
+        batch_size = _CHROMA_CLIENT.get_max_batch_size()
+        for start in range(0, len(texts), batch_size):
+            end = start + batch_size
+            vector_store._collection.add(
+                ids=[str(uuid.uuid4()) for _ in texts[start:end]],
+                embeddings=embeddings[start:end],
+                documents=texts[start:end],
+                metadatas=metadatas[start:end],
+            )
     print(f"Ingestion complete for {filename}. Vectors stored in collection: {collection_name}")
 
 
+@contextmanager
+def _checkout_reranker():
+    """Takes a reranker from the pool for one scoring call, waiting if all are busy."""
+    reranker = _RERANKER_POOL.get()
+    try:
+        yield reranker
+    finally:
+        _RERANKER_POOL.put(reranker)
+
+
+def _score_pretokenized(reranker: CrossEncoder, query: str, docs: list) -> np.ndarray:
+    """
+    Cross-encoder scores for (query, doc) pairs built from the doc token IDs
+    stored at ingest, so only the query goes through the tokenizer.
+    """
+    tokenizer = RERANK_TOKENIZER
+    query_ids = tokenizer(query, add_special_tokens=False)["input_ids"][:RERANK_MAX_QUERY_TOKENS]
+    doc_budget = RERANK_MAX_LENGTH - len(query_ids) - 3
+    head = [tokenizer.cls_token_id, *query_ids, tokenizer.sep_token_id]
+    sequences = [
+        (head + _decode_token_ids(doc.metadata[RERANK_TOKENS_METADATA_KEY])[:doc_budget]
+         + [tokenizer.sep_token_id])
+        for doc in docs
+    ]
+
+    model = reranker.model
+    order = sorted(range(len(sequences)), key=lambda i: len(sequences[i]))
+    scores = np.empty(len(sequences), dtype=np.float32)
+    for start in range(0, len(order), RERANK_MINI_BATCH_SIZE):
+        rows = order[start:start + RERANK_MINI_BATCH_SIZE]
+        batch = [sequences[i] for i in rows]
+        width = max(len(seq) for seq in batch)
+        input_ids = np.full((len(batch), width), tokenizer.pad_token_id, dtype=np.int64)
+        attention_mask = np.zeros((len(batch), width), dtype=np.int64)
+        token_type_ids = np.zeros((len(batch), width), dtype=np.int64)
+        for row, seq in enumerate(batch):
+            input_ids[row, :len(seq)] = seq
+            attention_mask[row, :len(seq)] = 1
+            token_type_ids[row, len(head):len(seq)] = 1
+        features = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in tokenizer.model_input_names:
+            features["token_type_ids"] = token_type_ids
+        features = {name: torch.from_numpy(value).to(model.device) for name, value in features.items()}
+        with torch.inference_mode():
+            logits = model(**features).logits
+            scores[rows] = reranker.activation_fn(logits[:, 0]).float().cpu().numpy()
+    return scores
+
+
+def _score_pairs(reranker: CrossEncoder, query: str, docs: list) -> np.ndarray:
+    """Cross-encoder scores for (query, doc) pairs, from stored token IDs when every doc has them."""
+    if all(RERANK_TOKENS_METADATA_KEY in doc.metadata for doc in docs):
+        return _score_pretokenized(reranker, query, docs)
+    # Chunks ingested before token IDs were stored are bucketed by character length
+    scores = np.empty(len(docs), dtype=np.float32)
+    buckets = np.searchsorted(RERANK_LENGTH_BUCKETS, [len(query) + len(doc.page_content) for doc in docs])
+    for bucket in np.unique(buckets):
+        members = np.flatnonzero(buckets == bucket)
+        scores[members] = reranker.predict(
+            [(query, docs[i].page_content) for i in members],
+            batch_size=RERANK_BATCH_SIZE, convert_to_numpy=True, show_progress_bar=False,
+        )
+    return scores
+
+
+def _rerank(query: str, docs: list) -> list:
+    """
+    Orders retrieved documents by cross-encoder relevance and keeps the top
+    RERANK_TOP_N. Scores seen before come from RERANK_SCORE_CACHE; the rest are
+    computed in length-sorted batches.
+    """
+    if not docs:
+        return []
+    query_hash = hashlib.sha1(query.encode("utf-8")).digest()
+    keys = [(query_hash, hashlib.sha1(doc.page_content.encode("utf-8")).digest()) for doc in docs]
+
+    scores = np.empty(len(docs), dtype=np.float32)
+    misses = []
+    for i, key in enumerate(keys):
+        score = RERANK_SCORE_CACHE.get(key)
+        if score is None:
+            misses.append(i)
+        else:
+            scores[i] = score
+
+    if misses:
+        with _checkout_reranker() as reranker:
+            miss_scores = _score_pairs(reranker, query, [docs[i] for i in misses])
+        for i, score in zip(misses, miss_scores):
+            scores[i] = score
+            RERANK_SCORE_CACHE.set(keys[i], float(score))
+
+    # Select the top N in O(k) and sort only those
+    if len(scores) > RERANK_TOP_N:
+        top = np.argpartition(scores, -RERANK_TOP_N)[-RERANK_TOP_N:]
+    else:
+        top = np.arange(len(scores))
+    top = top[np.argsort(-scores[top])]
+    return [docs[i] for i in top]
+
+
+# The instructions never change, so they go in the system message and form a
+# stable prompt prefix; only the user message varies between calls.
+RAG_SYSTEM_INSTRUCTIONS = (
+    "You are a helpful assistant. Answer the user's question based ONLY on the context they provide.\n"
+    "If the context does not contain the answer, state that you don't have enough information."
+)
+RAG_USER_TEMPLATE = """CONTEXT:
+{context}
+
+QUESTION:
+{question}
+
+ANSWER:"""
+
+# The prompt and output parser are stateless, so all chains share one instance.
+_RAG_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", RAG_SYSTEM_INSTRUCTIONS),
+    ("human", RAG_USER_TEMPLATE),
+])
+_OUTPUT_PARSER = StrOutputParser()
+
+
 def create_rag_chain(filename: str, api_key: str):
+    """
+    Returns the RAG chain for a specific document, building it on first use.
+    """
+    key = (filename, api_key)
+    with _CHAINS_LOCK:
+        chain = _CHAINS.get(key)
+        if chain is None:
+            chain = _build_rag_chain(filename, api_key)
+            _CHAINS.set(key, chain)
+    return chain
+
+
+def clear_chain_cache(api_key: str = None):
+    """Drops cached RAG chains, e.g. after an API key is rotated. Without a key, drops all of them."""
+    if api_key is None:
+        _CHAINS.clear()
+    else:
+        _CHAINS.invalidate(lambda key: key[1] == api_key)
+
+
+def _retrieve(filename: str, vector_store: Chroma, embedding) -> list:
+    """
+    Returns the RETRIEVER_K (chunk, cosine distance) pairs nearest to a query
+    embedding, using RETRIEVAL_CACHE.
+    """
+    # Adding 0.0 turns -0.0 into 0.0 so both round to the same key.
+    rounded = np.round(np.asarray(embedding, dtype=np.float32), 3) + np.float32(0.0)
+    key = (filename, hashlib.blake2b(rounded.tobytes(), digest_size=16).digest())
+    hits = RETRIEVAL_CACHE.get(key)
+    if hits is None:
+        hits = vector_store.similarity_search_by_vector_with_relevance_scores(embedding, k=RETRIEVER_K)
+        RETRIEVAL_CACHE.set(key, hits)
+    return hits
+
+
+def _max_distance(vector_store: Chroma) -> float:
+    """RETRIEVAL_MAX_DISTANCE expressed in the distance space of the collection."""
+    space = (vector_store._collection.metadata or {}).get("hnsw:space", "l2")
+    return RETRIEVAL_MAX_DISTANCE * _DISTANCE_SCALE.get(space, 1.0)
+
+
+def _select_context(question: str, hits: list, max_distance: float = RETRIEVAL_MAX_DISTANCE) -> list:
+    """Picks the context chunks from retrieval hits, reranking only when it can change the answer."""
+    close = [doc for doc, distance in hits if distance < max_distance]
+    if not close:
+        return _rerank(question, [doc for doc, _ in hits])
+    if len(close) < RERANK_MIN_CANDIDATES:
+        return close
+    return _rerank(question, close)
+
+
+_SENTENCE_END = re.compile(r"[.!?](?=\s)|\n")
+
+
+def _join_capped(docs: list, max_chars: int = CONTEXT_MAX_CHARS) -> str:
+    """
+    Joins chunk texts with blank lines up to `max_chars`. The chunk that crosses
+    the limit is cut at its last sentence end (or word break) that still fits.
+    """
+    parts = []
+    used = 0
+    for doc in docs:
+        separator = 2 if parts else 0
+        room = max_chars - used - separator
+        if room <= 0:
+            break
+        text = doc.page_content
+        if len(text) > room:
+            head = text[:room]
+            ends = [m.end() for m in _SENTENCE_END.finditer(head)]
+            cut = ends[-1] if ends else head.rfind(" ")
+            if cut > 0:
+                parts.append(head[:cut].rstrip())
+            break
+        parts.append(text)
+        used += separator + len(text)
+    return "\n\n".join(parts)
+
+
+def _build_rag_chain(filename: str, api_key: str):
     """
     Creates the full RAG chain with a retriever and re-ranker for a specific document.
     """
-    collection_name = sanitize_filename_for_collection(filename)
+    collection_name = _document_collection_name(filename)
 
-    vector_store = Chroma(
-        collection_name=collection_name,
-        embedding_function=EMBEDDING_MODEL,
-        persist_directory=VECTORSTORE_DIRECTORY
-    )
-    retriever = vector_store.as_retriever(search_kwargs={"k": 25})
-
-    def rerank_docs(inputs):
-        query = inputs['question']
-        docs = inputs['context']
-        pairs = [[query, doc.page_content] for doc in docs]
-        scores = CROSS_ENCODER_MODEL.predict(pairs)
-        doc_scores = list(zip(docs, scores))
-        doc_scores.sort(key=lambda x: x[1], reverse=True)
-        return [doc for doc, score in doc_scores[:5]]
-
-    rag_prompt = PromptTemplate.from_template(
-        """
-        You are a helpful assistant. Answer the user's question based ONLY on the following context.
-        If the context does not contain the answer, state that you don't have enough information.
-
-        CONTEXT:
-        {context}
-
-        QUESTION:
-        {question}
-
-        ANSWER:
-        """
-    )
-    llm = ChatGoogleGenerativeAI(model="gemini-1.5-flash", google_api_key=api_key)
+    def retrieve_and_rerank(inputs: dict) -> dict:
+        # Retrieval, reranking and context assembly in one step, so the chain
+        # does not build and reshape intermediate dicts between them. The query
+        # embedding computed for the answer cache is reused for the search. The
+        # handle is looked up per call, so a rebuilt collection is never missed.
+        question = inputs["question"]
+        vector_store = _get_vector_store(collection_name)
+        hits = _retrieve(filename, vector_store, inputs["embedding"])
+        docs = _select_context(question, hits, _max_distance(vector_store))
+        return {"context": _join_capped(docs), "question": question}
 
-    setup_and_retrieval = RunnableParallel(
-        {"context": retriever, "question": RunnablePassthrough()}
-    )
+    llm = _text_llm(api_key)
 
     rag_chain = (
-            setup_and_retrieval
-            | RunnablePassthrough.assign(context=RunnableLambda(rerank_docs))
-            | {
-                "context": lambda x: "\n\n".join(doc.page_content for doc in x["context"]),
-                "question": lambda x: x["question"],
-            }
-            | rag_prompt
+            RunnableLambda(retrieve_and_rerank)
+            | _RAG_PROMPT
             | llm
-            | StrOutputParser()
+            | _OUTPUT_PARSER
     )
     return rag_chain
 
 
+async def stream_answer(filename: str, query: str, api_key: str):
+    """
+    Yields the answer to `query` as it is generated. Answers already in
+    QUERY_CACHE are yielded in one piece without running the chain.
+    """
+    cached = QUERY_CACHE.get_exact(filename, query)
+    if cached is not None:
+        yield cached
+        return
+
+    question_embedding = await EMBEDDING_MODEL.aembed_query(query)
+    cached = QUERY_CACHE.get_similar(filename, question_embedding)
+    if cached is not None:
+        yield cached
+        return
+
+    loop = asyncio.get_running_loop()
+    rag_chain = await loop.run_in_executor(None, create_rag_chain, filename, api_key)
+
+    # Retrieval and reranking finish before the first token is produced;
+    # only the LLM output is streamed.
+    parts = []
+    async for chunk in rag_chain.astream({"question": query, "embedding": question_embedding}):
+        parts.append(chunk)
+        yield chunk
+    QUERY_CACHE.add(filename, query, question_embedding, "".join(parts))
+
+
+# A mini-batch of 8 pairs of about 128 tokens, the shape of a typical rerank call
+_WARMUP_PAIRS = [("warmup query", "warmup document " * 60)] * RERANK_MINI_BATCH_SIZE
+WARMUP_ITERATIONS = 3
+
+
+def _warm_up_reranker(reranker: CrossEncoder):
+    for _ in range(WARMUP_ITERATIONS):
+        reranker.predict(_WARMUP_PAIRS, batch_size=RERANK_MINI_BATCH_SIZE, show_progress_bar=False)
+
+
+def warm_up_models():
+    """
+    Runs a few inferences through each local model and one search through every
+    stored collection, so lazy allocations, kernel selection and HNSW index loads
+    happen at startup instead of on the first user query.
+    """
+    print("Warming up models...")
+    warmup_embedding = EMBEDDING_MODEL.embed_query("warmup")
+    try:
+        _warm_up_reranker(CROSS_ENCODER_MODEL)
+    except Exception as e:
+        if CROSS_ENCODER_MODEL.model is _EAGER_CROSS_ENCODER_MODULE:
+            raise
+        print(f"Could not compile the reranker, running it in eager mode: {e}")
+        CROSS_ENCODER_MODEL.model = _EAGER_CROSS_ENCODER_MODULE
+        _warm_up_reranker(CROSS_ENCODER_MODEL)
+    for reranker in _RERANKERS[1:]:
+        _warm_up_reranker(reranker)
+    _start_embedding_pool()
+    print("Models warmed up.")
+
+    for collection in _CHROMA_CLIENT.list_collections():
+        # chromadb 0.6 lists collection names; other versions list Collection objects
+        collection_name = getattr(collection, "name", collection)
+        try:
+            _get_vector_store(collection_name).similarity_search_by_vector(warmup_embedding, k=RERANK_TOP_N)
+        except Exception as e:
+            print(f"Could not warm up collection {collection_name}: {e}")
+
+
+def _start_embedding_pool():
+    """Starts the embedding worker processes if EMBEDDING_POOL_PROCESSES asks for them."""
+    global _EMBEDDING_POOL
+    if (_EMBEDDING_POOL is not None or EMBEDDING_POOL_PROCESSES < 2
+            or MODEL_DEVICE != "cpu" or EMBEDDING_BACKEND == "onnx"):
+        return
+    print(f"Starting {EMBEDDING_POOL_PROCESSES} embedding worker processes...")
+    _EMBEDDING_POOL = EMBEDDING_MODEL.client.start_multi_process_pool(
+        target_devices=["cpu"] * EMBEDDING_POOL_PROCESSES
+    )
+    atexit.register(EMBEDDING_MODEL.client.stop_multi_process_pool, _EMBEDDING_POOL)
+
+
+def save_query_cache():
+    """Persists the query cache so the next start begins warm."""
+    QUERY_CACHE.save(QUERY_CACHE_PATH)
+
+
+def _legacy_image_ids(vector_store: Chroma, filename: str) -> list:
+    """
+    IDs of image descriptions ingested before they were tagged with the document
+    name; their source is the extracted image's path under UPLOAD_DIRECTORY. They
+    can only be attributed to `filename` when no other document shares the
+    collection, otherwise they are left alone.
+    """
+    if _holds_other_documents(vector_store, filename):
+        return []
+    images = vector_store._collection.get(where={"type": "image_description"}, include=["metadatas"])
+    upload_root = os.path.abspath(UPLOAD_DIRECTORY) + os.sep
+    return [
+        chunk_id for chunk_id, metadata in zip(images["ids"], images["metadatas"])
+        if "image_path" not in metadata
+        and os.path.abspath(str(metadata.get("source", ""))).startswith(upload_root)
+    ]
+
+
 # *** NEW FUNCTION TO DELETE VECTORS ***
 def delete_document_vectors(filename: str):
     """
     Deletes all vectors associated with a specific filename from its ChromaDB collection.
     """
-    collection_name = sanitize_filename_for_collection(filename)
+    collection_name = _document_collection_name(filename)
+    QUERY_CACHE.invalidate(filename)
+    RETRIEVAL_CACHE.invalidate(lambda key: key[0] == filename)
+    _CHAINS.invalidate(lambda key: key[0] == filename)
 
     try:
         # Connect to the persistent ChromaDB
-        vector_store = Chroma(
-            collection_name=collection_name,
-            embedding_function=EMBEDDING_MODEL,
-            persist_directory=VECTORSTORE_DIRECTORY
-        )
-
-        # Get all documents in the collection to find their IDs
-        # This is necessary because Chroma's delete works by ID
-        all_docs = vector_store.get(include=["metadatas"])
-
-        if not all_docs or not all_docs['ids']:
-            print(f"No vectors found for document: {filename} in collection {collection_name}. Nothing to delete.")
-            return
+        vector_store = _get_vector_store(collection_name)
 
-        ids_to_delete = [
-            doc_id for i, doc_id in enumerate(all_docs['ids'])
-            if all_docs['metadatas'][i].get('source') == filename
-        ]
-
-        if ids_to_delete:
-            print(f"Found {len(ids_to_delete)} vectors to delete for document: {filename}")
-            vector_store.delete(ids=ids_to_delete)
-            vector_store.persist()
-            print(f"Successfully deleted vectors for {filename}.")
-        else:
-            print(f"No vectors specifically matching source '{filename}' found for deletion.")
+        # Let Chroma filter by metadata server-side in a single call.
+        legacy_image_ids = _legacy_image_ids(vector_store, filename)
+        vector_store._collection.delete(where={"source": filename})
+        if legacy_image_ids:
+            vector_store._collection.delete(ids=legacy_image_ids)
+        print(f"Successfully deleted vectors for {filename}.")
 
     except Exception as e:
         print(f"An error occurred while trying to delete vectors for {filename}: {e}")
@@ -84,19 +84,34 @@ export default function App() {
     setQuery('');
 
     try {
-      const response = await axios.post(
-        `${API_URL}/query/${selectedDocument}`,
-        null,
+      // The answer is streamed as plain text, so append chunks as they arrive
+      const response = await fetch(
+        `${API_URL}/query/${encodeURIComponent(selectedDocument)}?${new URLSearchParams({ query })}`,
         {
-          params: { query },
+          method: 'POST',
           headers: { 'gemini-api-key': apiKey }
         }
       );
-      const assistantMessage = { role: 'assistant', content: response.data.answer };
-      setMessages(prev => [...prev, assistantMessage]);
+      if (!response.ok) {
+        const body = await response.json().catch(() => ({}));
+        throw new Error(body.detail || "An unexpected error occurred while querying.");
+      }
+
+      setMessages(prev => [...prev, { role: 'assistant', content: '' }]);
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        const text = decoder.decode(value, { stream: true });
+        setMessages(prev => {
+          const last = prev[prev.length - 1];
+          return [...prev.slice(0, -1), { ...last, content: last.content + text }];
+        });
+      }
     } catch (err) {
       console.error("Error sending query:", err);
-      const errorMessage = err.response?.data?.detail || "An unexpected error occurred while querying.";
+      const errorMessage = err.message || "An unexpected error occurred while querying.";
       setError(errorMessage);
       setMessages(prev => [...prev, { role: 'assistant', content: `Error: ${errorMessage}` }]);
     } finally {
@@ -5,11 +5,56 @@ import {
   Bot, User, ChevronsRight, Sparkles, Eye, EyeOff, Clipboard
 } from 'lucide-react';
 
-
+const API_URL = 'http://127.0.0.1:8000';
+// How often an uploaded document's ingestion status is checked
+const STATUS_POLL_INTERVAL_MS = 1500;
 
 export const Sidebar = ({ documents, selectedDocument, onSelectDocument, fetchDocuments, apiKey, setError, isOpen, setIsOpen, onSettingsClick }) => {
   const fileInputRef = useRef(null);
   const [showKey, setShowKey] = useState(false);
+  // Document name -> "uploading" | "queued" | "processing" while it is being ingested
+  const [ingestion, setIngestion] = useState({});
+  const pollTimers = useRef({});
+
+  useEffect(() => () => Object.values(pollTimers.current).forEach(clearTimeout), []);
+
+  // Uploads are ingested in the background, so poll /status/ until the
+  // document is ready or ingestion fails.
+  const pollStatus = useCallback((docName) => {
+    const finish = () => {
+      delete pollTimers.current[docName];
+      setIngestion(prev => {
+        const next = { ...prev };
+        delete next[docName];
+        return next;
+      });
+      fetchDocuments();
+    };
+
+    const check = async () => {
+      try {
+        const response = await axios.get(`${API_URL}/status/${encodeURIComponent(docName)}`);
+        const { status, detail } = response.data;
+        if (status === 'ready' || status === 'error') {
+          finish();
+          if (status === 'error') {
+            setError(detail || `Failed to process ${docName}.`);
+          }
+          return;
+        }
+        setIngestion(prev => ({ ...prev, [docName]: status }));
+      } catch (err) {
+        if (err.response?.status === 404) {
+          // The document was deleted meanwhile
+          finish();
+          return;
+        }
+        console.error("Error checking ingestion status:", err);
+      }
+      pollTimers.current[docName] = setTimeout(check, STATUS_POLL_INTERVAL_MS);
+    };
+    check();
+  }, [fetchDocuments, setError]);
 
   const handleFileUpload = async (event) => {
     const file = event.target.files[0];
@@ -19,16 +64,22 @@ export const Sidebar = ({ documents, selectedDocument, onSelectDocument, fetchDo
     formData.append('file', file);
 
     try {
-      await axios.post(`${API_URL}/upload/`, formData, {
+      const response = await axios.post(`${API_URL}/upload/`, formData, {
         headers: {
           'Content-Type': 'multipart/form-data',
           'gemini-api-key': apiKey
         }
       });
+      const { filename, status } = response.data;
+      setIngestion(prev => ({ ...prev, [filename]: status }));
       fetchDocuments();
+      pollStatus(filename);
     } catch (err) {
       console.error("Error uploading file:", err);
       setError(err.response?.data?.detail || "Failed to upload file.");
+    } finally {
+      // Allow picking the same file again after a failed upload
+      event.target.value = '';
     }
   };
 
@@ -72,12 +123,20 @@ export const Sidebar = ({ documents, selectedDocument, onSelectDocument, fetchDo
             {documents.map(doc => (
               <div
                 key={doc}
-                onClick={() => onSelectDocument(doc)}
-                className={`flex items-center justify-between p-3 rounded-lg cursor-pointer transition-colors ${selectedDocument === doc ? 'bg-indigo-500' : 'bg-gray-800 hover:bg-gray-700'}`}
+                onClick={() => !ingestion[doc] && onSelectDocument(doc)}
+                className={`flex items-center justify-between p-3 rounded-lg transition-colors ${ingestion[doc] ? 'cursor-wait opacity-70' : 'cursor-pointer'} ${selectedDocument === doc ? 'bg-indigo-500' : 'bg-gray-800 hover:bg-gray-700'}`}
               >
                 <div className="flex items-center gap-3 overflow-hidden">
                   <FileText size={18} className="flex-shrink-0" />
-                  <span className="truncate" title={doc}>{doc}</span>
+                  <div className="flex flex-col overflow-hidden">
+                    <span className="truncate" title={doc}>{doc}</span>
+                    {ingestion[doc] && (
+                      <span className="flex items-center gap-1 text-xs text-gray-400">
+                        <Loader size={12} className="animate-spin" />
+                        {ingestion[doc]}...
+                      </span>
+                    )}
+                  </div>
                 </div>
                 <button onClick={(e) => handleDeleteDocument(doc, e)} className="text-gray-400 hover:text-red-500 flex-shrink-0">
                   <Trash2 size={16} />